@@ -14,8 +14,14 @@
 #include <linux/interrupt.h>
 #include <linux/kfifo.h>
 #include <linux/module.h>
+#include <linux/poll.h>
 #include <linux/uaccess.h>
 #include <linux/sched/clock.h>
+#include <linux/version.h>
+
+#if LINUX_VERSION_CODE < KERNEL_VERSION(4, 16, 0)
+typedef unsigned int __poll_t;
+#endif
 
 #define DEVNAME			"rxb6"
 
@@ -173,12 +179,24 @@ static ssize_t rxb6_read(struct file *file, char __user *buf, size_t count,
 	return err ? err : copied;
 }
 
+static __poll_t rxb6_poll(struct file *file, poll_table *wait)
+{
+	poll_wait(file, &rxb6_fifo_wq, wait);
+
+	/* Readable if there's FIFO data */
+	if (!kfifo_is_empty(&rxb6_fifo))
+		return POLLIN | POLLRDNORM;
+
+	return 0;
+}
+
 static struct file_operations rxb6_fops =
 {
 	.owner          = THIS_MODULE,
 	.open           = rxb6_open,
 	.release        = rxb6_release,
 	.read           = rxb6_read,
+	.poll           = rxb6_poll,
 };
 
 /* -------------------------------------------------------------------------
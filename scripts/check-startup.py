@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Check the import time of short rxb6 commands against a budget
+#
+# Copyright (C) 2018 Juerg Haefliger <juergh@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Absolute import times depend on the machine and vary by a factor of two
+# between runs, so the budgets are relative to the import time of the bare
+# interpreter ('python3 -c pass'), measured right before each command run.
+# The ratios are stable to about 0.1 and carry over to other machines: on a
+# Raspberry Pi, the import time of a command is its ratio times the Pi's own
+# baseline, which this script prints when run there.
+#
+# Short commands that are expected to start quickly and their budgets as
+# multiples of the baseline. The budgets leave about 50% headroom over the
+# measured ratios (2.6x for -h, 3.5x for dump, 4.6x for the commands that
+# need sqlite3). '{tmp}' is replaced with the path of a temporary directory.
+COMMANDS = (
+    (4, ("rxb6-util.py", "-h")),
+    (5, ("rxb6-util.py", "dump", "{tmp}/rxb6.db")),
+    (5, ("rxb6-util.py", "dump", "-f", "jsonl", "{tmp}/rxb6.db")),
+    (7, ("rxb6-util.py", "expire", "{tmp}/rxb6.db", "30")),
+    (7, ("rxb6-log.py", "-h")),
+)
+
+
+def import_times(argv):
+    """
+    Run a command with -X importtime and return a dict of the cumulative
+    import times (in usecs) of the top-level imports
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + argv,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True, cwd=DIR)
+    result = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        # Nested imports are indented
+        if name.startswith("  "):
+            continue
+        result[name.strip()] = int(fields[1])
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def command_time(argv, runs):
+    """
+    Return the median baseline import time and the median ratio of the
+    additional import time of a command to the baseline over a number of runs
+    """
+    baselines = []
+    ratios = []
+    for _ in range(runs):
+        baseline = import_times(["-c", "pass"])
+        times = import_times(argv)
+        total = sum(t for m, t in times.items() if m not in baseline)
+        baselines.append(sum(baseline.values()))
+        ratios.append(total / baselines[-1])
+    return median(baselines), median(ratios)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scale", type=float, default=1, help="The "
+                        "factor to scale the budgets by. Defaults to 1 if not "
+                        "set.")
+    parser.add_argument("-r", "--runs", type=int, default=7, help="The number "
+                        "of runs per command. Defaults to 7 if not set.")
+    args = parser.parse_args()
+
+    failed = 0
+    baselines = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for budget, cmd in COMMANDS:
+            argv = [os.path.join(DIR, cmd[0])] + [a.format(tmp=tmp)
+                                                  for a in cmd[1:]]
+            baseline, ratio = command_time(argv, args.runs)
+            baselines.append(baseline)
+            status = "ok"
+            if ratio > budget * args.scale:
+                status = "OVER BUDGET"
+                failed += 1
+            print("%5.1fx (budget %4.1fx) %8.1f ms  %-11s %s" %
+                  (ratio, budget * args.scale, ratio * baseline / 1000,
+                   status, " ".join(cmd)))
+
+    print("Baseline (bare interpreter): %.1f ms" %
+          (median(baselines) / 1000))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+#
+# Alert rule engine for decoded sensor data
+#
+# Copyright (C) 2018 Juerg Haefliger <juergh@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+
+import logging
+import os
+import socket
+import subprocess
+import time
+
+from lib import config as _config
+from lib.sensors import Reading
+
+# Rules are read from a YAML file that contains a list of rules, for example:
+#
+#   - name: freezer-warm
+#     type: threshold
+#     sensor: freezer
+#     field: temperature
+#     max: -15
+#     action:
+#       exec: "mail -s 'Freezer warming up' root < /dev/null"
+#
+#   - name: fast-rise
+#     type: rate
+#     field: temperature
+#     max: 1.0          # change per minute
+#     period: 300       # seconds between rate samples (default: 300)
+#     action:
+#       file: /var/log/rxb6-alerts.log
+#
+#   - name: silent
+#     type: stale
+#     minutes: 15
+#     action:
+#       socket: /run/rxb6-alerts.sock
+#
+#   - name: battery
+#     type: battery
+#     action:
+#       socket: alerts.example.com:5514
+#
+# 'sensor' is a sensor name (or a list of names) from the sensor config file.
+# Rules without 'sensor' apply to all sensors. 'action' can contain any
+# combination of:
+#   exec:   A shell command. Alert details are passed in the environment
+#           (RXB6_RULE, RXB6_SENSOR, RXB6_STATE, RXB6_MESSAGE, RXB6_TIMESTAMP).
+#   file:   A file to append an alert line to.
+#   socket: A unix datagram socket path or a host:port UDP address to send an
+#           alert line to.
+#
+# Alerts are edge-triggered: An action runs once when a rule starts firing
+# for a sensor and once more when it clears.
+
+
+# -----------------------------------------------------------------------------
+# Actions
+
+class Action(object):
+    """
+    Local alert action
+    """
+    def __init__(self, config):
+        self.command = config.get("exec")
+        self.file = config.get("file")
+        self.socket = config.get("socket")
+        self._children = []
+
+    def _exec(self, alert):
+        env = dict(os.environ)
+        env.update({
+            "RXB6_RULE": alert["rule"],
+            "RXB6_SENSOR": alert["sensor"],
+            "RXB6_STATE": alert["state"],
+            "RXB6_MESSAGE": alert["message"],
+            "RXB6_TIMESTAMP": str(alert["timestamp"]),
+        })
+        # Don't wait for the command, we're in the middle of reading data
+        self._children.append(subprocess.Popen(self.command, shell=True,
+                                               env=env))
+
+    def _write(self, line):
+        with open(self.file, "a") as fh:
+            fh.write(line + "\n")
+
+    def _send(self, line):
+        if self.socket.startswith("/"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            addr = self.socket
+        else:
+            host, port = self.socket.rsplit(":", 1)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            addr = (host, int(port))
+        try:
+            sock.sendto(line.encode(), addr)
+        finally:
+            sock.close()
+
+    def reap(self):
+        """
+        Reap finished child processes
+        """
+        self._children = [c for c in self._children if c.poll() is None]
+
+    def run(self, alert):
+        """
+        Run the action for an alert
+        """
+        line = "%(timestamp)s %(state)s %(rule)s %(sensor)s: %(message)s" % \
+            alert
+        try:
+            if self.command:
+                self._exec(alert)
+            if self.file:
+                self._write(line)
+            if self.socket:
+                self._send(line)
+        except (OSError, ValueError) as e:
+            logging.warning("Alert action failed (%s)", e)
+        self.reap()
+
+
+# -----------------------------------------------------------------------------
+# Rules
+
+class Rule(object):
+    """
+    Base class for alert rules
+
+    Subclasses implement check(sensor, data) which checks the rule against a
+    data record and returns an alert message if the rule fires or None
+    otherwise.
+    """
+    def __init__(self, config):
+        self.name = config.get("name", config["type"])
+        sensor = config.get("sensor")
+        if sensor is None:
+            self.sensors = None
+        elif isinstance(sensor, list):
+            self.sensors = set(sensor)
+        else:
+            self.sensors = set([sensor])
+        self.field = config.get("field", "temperature")
+        self.action = Action(config.get("action", {}))
+        # Per-sensor rule state
+        self.state = {}
+        # Sensors the rule is currently firing for
+        self.firing = set()
+
+    def matches(self, sensor):
+        return self.sensors is None or sensor in self.sensors
+
+    def update(self, sensor, timestamp, message):
+        """
+        Update the firing state of the rule and run the action on a change
+        """
+        if message is not None and sensor not in self.firing:
+            self.firing.add(sensor)
+            state = "FIRING"
+        elif message is None and sensor in self.firing:
+            self.firing.discard(sensor)
+            state = "CLEARED"
+            message = "back to normal"
+        else:
+            return
+
+        logging.info("Alert %s %s %s: %s", state, self.name, sensor, message)
+        self.action.run({
+            "timestamp": timestamp,
+            "rule": self.name,
+            "sensor": sensor,
+            "state": state,
+            "message": message,
+        })
+
+
+class ThresholdRule(Rule):
+    """
+    Fire if a value is outside of [min, max]
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.min = config.get("min")
+        self.max = config.get("max")
+
+    def check(self, sensor, data):
+        value = getattr(data, self.field)
+        if self.min is not None and value < self.min:
+            return "%s %s < %s" % (self.field, value, self.min)
+        if self.max is not None and value > self.max:
+            return "%s %s > %s" % (self.field, value, self.max)
+        return None
+
+
+class RateRule(Rule):
+    """
+    Fire if a value changes faster than 'max' per minute
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.max = config["max"]
+        self.period = config.get("period", 300)
+
+    def check(self, sensor, data):
+        timestamp = data.timestamp
+        value = getattr(data, self.field)
+
+        # Compare against a reference sample that is at least 'period'
+        # seconds old, which keeps the state per sensor constant
+        ref = self.state.get(sensor)
+        if ref is None:
+            self.state[sensor] = (timestamp, value, None)
+            return None
+        ref_timestamp, ref_value, message = ref
+        if timestamp - ref_timestamp < self.period:
+            # Not enough time has passed, keep the previous verdict
+            return message
+
+        rate = (value - ref_value) * 60 / (timestamp - ref_timestamp)
+        message = None
+        if abs(rate) > self.max:
+            message = "%s changing at %.2f/min" % (self.field, rate)
+        self.state[sensor] = (timestamp, value, message)
+        return message
+
+
+class StaleRule(Rule):
+    """
+    Fire if no data is received from a sensor for 'minutes' minutes
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.timeout = config["minutes"] * 60
+        # Sensors listed in the rule are watched from the start
+        now = int(time.time())
+        for sensor in self.sensors or ():
+            self.state[sensor] = now
+
+    def check(self, sensor, data):
+        self.state[sensor] = data.timestamp
+        return None
+
+    def check_stale(self, now):
+        """
+        Check all sensors for staleness
+        """
+        for sensor, last_seen in self.state.items():
+            message = None
+            if now - last_seen > self.timeout:
+                message = "no data for %d minutes" % ((now - last_seen) / 60)
+            self.update(sensor, now, message)
+
+
+class BatteryRule(Rule):
+    """
+    Fire if a sensor reports a bad battery
+    """
+    def check(self, sensor, data):
+        if data.battery_status:
+            return "battery bad"
+        return None
+
+
+RULES = {
+    "threshold": ThresholdRule,
+    "rate": RateRule,
+    "stale": StaleRule,
+    "battery": BatteryRule,
+}
+
+# Required rule config keys
+REQUIRED = {
+    "rate": ("max",),
+    "stale": ("minutes",),
+}
+
+# Numeric rule config keys
+NUMERIC = ("min", "max", "minutes", "period")
+
+# Data record fields that rules can be evaluated on
+FIELDS = tuple(f for f in Reading._fields if f not in ("sensor", "name"))
+
+
+def validate(config):
+    """
+    Validate a rule config and raise ValueError if it is invalid
+    """
+    if not isinstance(config, dict):
+        raise ValueError("Invalid alert rule: %r" % (config,))
+
+    rule_type = config.get("type")
+    if rule_type not in RULES:
+        raise ValueError("Invalid alert rule type: %s" % rule_type)
+    name = config.get("name", rule_type)
+
+    field = config.get("field", "temperature")
+    if field not in FIELDS:
+        raise ValueError("Invalid field '%s' in alert rule %s (must be one of "
+                         "%s)" % (field, name, ", ".join(FIELDS)))
+
+    for key in REQUIRED.get(rule_type, ()):
+        if key not in config:
+            raise ValueError("Missing '%s' in alert rule %s" % (key, name))
+    if rule_type == "threshold" and "min" not in config and \
+       "max" not in config:
+        raise ValueError("Missing 'min' or 'max' in alert rule %s" % name)
+
+    for key in NUMERIC:
+        value = config.get(key)
+        if value is not None and (isinstance(value, bool) or
+                                  not isinstance(value, (int, float))):
+            raise ValueError("Invalid '%s' in alert rule %s: %r" %
+                             (key, name, value))
+
+    if config.get("period", 1) <= 0:
+        raise ValueError("Invalid 'period' in alert rule %s" % name)
+
+    if not isinstance(config.get("action", {}), dict):
+        raise ValueError("Invalid action in alert rule %s" % name)
+
+
+# -----------------------------------------------------------------------------
+# Engine
+
+class AlertEngine(object):
+    """
+    Evaluate alert rules on decoded data records as they arrive
+    """
+    def __init__(self, rules):
+        if rules is None:
+            rules = []
+        if not isinstance(rules, list):
+            raise ValueError("Alert rules need to be a list")
+
+        self.rules = []
+        for config in rules:
+            validate(config)
+            self.rules.append(RULES[config["type"]](config))
+        self.stale_rules = [r for r in self.rules if isinstance(r, StaleRule)]
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(_config.load(path))
+
+    def process(self, data):
+        """
+        Evaluate the rules for a decoded data record
+        """
+        sensor = data.name or data.sensor
+        for rule in self.rules:
+            if rule.matches(sensor):
+                rule.update(sensor, data.timestamp, rule.check(sensor, data))
+
+    def check_stale(self, now=None):
+        """
+        Evaluate the staleness rules, needs to be called periodically
+        """
+        if now is None:
+            now = int(time.time())
+        for rule in self.stale_rules:
+            rule.check_stale(now)
+            rule.action.reap()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# Cached YAML config loader
+#
+# Copyright (C) 2018 Juerg Haefliger <juergh@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+
+import marshal
+import os
+
+# Parsing YAML (and importing the yaml module) is by far the most expensive
+# part of starting up the scripts. So the parsed config is cached in
+# marshal format next to the config file (<config>.cache) and the cache is
+# used as long as the modification time and size of the config file match.
+
+CACHE_VERSION = 1
+
+
+def _cache_path(path):
+    return path + ".cache"
+
+
+def _read_cache(path, st):
+    """
+    Return a (hit, config) tuple, hit is False if the cache is missing or
+    stale
+    """
+    try:
+        with open(_cache_path(path), "rb") as fh:
+            version, mtime, size, config = marshal.load(fh)
+    except (OSError, EOFError, ValueError, TypeError):
+        return False, None
+    if (version, mtime, size) != (CACHE_VERSION, st.st_mtime_ns, st.st_size):
+        return False, None
+    return True, config
+
+
+def _write_cache(path, st, config):
+    """
+    Write the config to the cache, failures are silently ignored
+    """
+    cache = _cache_path(path)
+    tmp = "%s.%d" % (cache, os.getpid())
+    try:
+        with open(tmp, "wb") as fh:
+            marshal.dump((CACHE_VERSION, st.st_mtime_ns, st.st_size, config),
+                         fh)
+        os.replace(tmp, cache)
+    except (OSError, ValueError):
+        # Not writable or the config contains types marshal can't handle
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def load(path):
+    """
+    Load a YAML config file, using the cache if it is up to date
+    """
+    st = os.stat(path)
+    hit, config = _read_cache(path, st)
+    if hit:
+        return config
+
+    import yaml
+    with open(path) as fh:
+        config = yaml.safe_load(fh)
+    _write_cache(path, st, config)
+    return config
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Sensor data export formats
+#
+# Copyright (C) 2018 Juerg Haefliger <juergh@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+
+from array import array
+import struct
+import sys
+
+# All writers take an iterable of row batches, each batch being a list of
+# (timestamp, name, temperature, humidity) rows, and write one batch at a
+# time so that memory use is bounded by the batch size.
+
+COLUMNS = ("timestamp", "name", "temperature", "humidity")
+
+# Columnar binary format (all integers and floats are little-endian):
+#
+#   Header:  8 bytes magic 'RXB6COL1'
+#   Block:   uint32   number of rows N (0 marks the end of the stream)
+#            int64[N] timestamps
+#            uint32   number of distinct names M
+#            M times: uint32 length L, L bytes UTF-8 name
+#            uint32[N] name indices
+#            float64[N] temperatures
+#            float64[N] humidities
+#
+# There is one block per batch.
+COLUMNAR_MAGIC = b"RXB6COL1"
+
+# Array typecode for uint32, the size of 'I' is platform dependent
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+
+def _array_bytes(typecode, values):
+    """
+    Return the little-endian bytes of an array of values
+    """
+    a = array(typecode, values)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def _array_read(typecode, fh, count):
+    """
+    Read a little-endian array of values
+    """
+    a = array(typecode)
+    a.frombytes(fh.read(a.itemsize * count))
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+# -----------------------------------------------------------------------------
+# Writers
+
+def write_text(batches, fh):
+    """
+    Write the rows as Python tuples, one per line
+    """
+    for rows in batches:
+        fh.write("".join("%r\n" % (row,) for row in rows))
+
+
+def write_csv(batches, fh):
+    """
+    Write the rows as CSV with a header line
+    """
+    import csv
+    writer = csv.writer(fh, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+
+
+def write_jsonl(batches, fh):
+    """
+    Write the rows as JSON Lines, one object per row
+    """
+    import json
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    for rows in batches:
+        fh.write("".join(dumps(dict(zip(COLUMNS, row))) + "\n"
+                         for row in rows))
+
+
+def write_columnar(batches, fh):
+    """
+    Write the rows in the columnar binary format, fh needs to be a binary
+    file
+    """
+    fh.write(COLUMNAR_MAGIC)
+    for rows in batches:
+        timestamps, names, temperatures, humidities = zip(*rows)
+
+        # Dictionary-encode the names
+        index = {}
+        for name in names:
+            if name not in index:
+                index[name] = len(index)
+
+        block = [struct.pack("<I", len(rows)),
+                 _array_bytes("q", timestamps),
+                 struct.pack("<I", len(index))]
+        for name in index:
+            encoded = name.encode()
+            block.append(struct.pack("<I", len(encoded)))
+            block.append(encoded)
+        block.append(_array_bytes(_UINT32, (index[n] for n in names)))
+        block.append(_array_bytes("d", temperatures))
+        block.append(_array_bytes("d", humidities))
+        fh.write(b"".join(block))
+    fh.write(struct.pack("<I", 0))
+
+
+FORMATS = {
+    "text": (write_text, False),
+    "csv": (write_csv, False),
+    "jsonl": (write_jsonl, False),
+    "columnar": (write_columnar, True),
+}
+
+
+# -----------------------------------------------------------------------------
+# Readers
+
+def read_columnar(fh):
+    """
+    Read a stream in the columnar binary format and return batches of rows
+    """
+    if fh.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Invalid columnar data")
+
+    while True:
+        (count,) = struct.unpack("<I", fh.read(4))
+        if not count:
+            break
+        timestamps = _array_read("q", fh, count)
+        (num_names,) = struct.unpack("<I", fh.read(4))
+        names = []
+        for _ in range(num_names):
+            (length,) = struct.unpack("<I", fh.read(4))
+            names.append(fh.read(length).decode())
+        indices = _array_read(_UINT32, fh, count)
+        temperatures = _array_read("d", fh, count)
+        humidities = _array_read("d", fh, count)
+        yield list(zip(timestamps, (names[i] for i in indices), temperatures,
+                       humidities))
@@ -8,44 +8,74 @@
 # under the terms of the GNU General Public License version 2 as published by
 # the Free Software Foundation.
 
+from collections import namedtuple
+import errno
 import logging
-import signal
-from socket import gethostname
-import sys
+import os
+import select
 import time
-import yaml
 
+from lib import config as _config
 from lib import sensors
 
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s " +
-                    gethostname() + " rxb6: %(message)s",
-                    datefmt="%b %d %H:%M:%S")
+def init_logging():
+    """
+    Configure logging for the rxb6 scripts
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s " +
+                        os.uname().nodename + " rxb6: %(message)s",
+                        datefmt="%b %d %H:%M:%S")
+
+
+# A single pulse returned by the rxb6 device
+Pulse = namedtuple("Pulse", "timestamp level width")
+
+# A data record decoded from a data set (a sequence of pulses)
+DataRecord = namedtuple("DataRecord", "timestamp data num_bits")
+
+# Averaged sensor data
+Average = namedtuple("Average", "timestamp name temperature humidity")
+
+
+def parse_pulse(timestamp, line):
+    """
+    Parse a pulse line returned by the rxb6 device
+    """
+    try:
+        level, width = line.split(' ')
+        return Pulse(timestamp, int(level), int(width))
+    except ValueError:
+        # Treat a malformed line as a zero-width pulse
+        return Pulse(timestamp, 0, 0)
 
 
 def average_data(data):
     """
     Average decoded sensor data
     """
-    # Split the data into lists for the individual sensors
+    # Accumulate the data of the individual sensors as
+    # [timestamp, temperature sum, humidity sum, count]
     sensor = {}
     for d in data:
-        key = d["name"]
-        if key not in sensor:
-            sensor[key] = []
-        sensor[key].append(d)
+        acc = sensor.get(d.name)
+        if acc is None:
+            sensor[d.name] = [d.timestamp, d.temperature, d.humidity, 1]
+        else:
+            acc[1] += d.temperature
+            acc[2] += d.humidity
+            acc[3] += 1
 
     # Calculate the averages for the individual sensors
     result = []
     for key in sorted(sensor):
-        result.append({
-            "timestamp": sensor[key][0]["timestamp"],
-            "name": key,
-            "temperature": int((sum(s["temperature"] for s in sensor[key]) /
-                                len(sensor[key])) * 10 + 0.5) / 10,
-            "humidity": int((sum(s["humidity"] for s in sensor[key]) /
-                             len(sensor[key])) * 10 + 0.5) / 10,
-        })
+        timestamp, temperature, humidity, count = sensor[key]
+        result.append(Average(
+            timestamp,
+            key,
+            int((temperature / count) * 10 + 0.5) / 10,
+            int((humidity / count) * 10 + 0.5) / 10,
+        ))
 
     return result
 
@@ -54,32 +84,24 @@ def decode_set(dataset):
     """
     Decode a sensor data set and return a data record
 
-    A data set is a list of sensor records returned by the rxb6 device. Each
-    sensor record is a tuple with three elements:
+    A data set is a list of Pulse records returned by the rxb6 device. Each
+    Pulse record has three elements:
       1. timestamp (seconds since the epoch)
       2. pulse level (0 or 1)
       3. pulse width (in microseconds)
 
-    The returned data record is a tuple with three elements:
+    The returned DataRecord has three elements:
       1. timestamp (seconds since the epoch)
       2. decoded data
       3. number of bits
     """
-    # Pull out the widths of the individual pulses
-    widths = [d[2] if len(d) == 3 else 0 for d in dataset]
-
-    # Ignore the last pulse width if the list has an odd length
-    if len(widths) % 2:
-        widths = widths[:-1]
-
-    # Sum the widths of consecutive low and high pulses to create the list of
-    # bit widths
-    bits = [int(widths[i]) + int(widths[i+1]) for i in range(0, len(widths), 2)]
-    num_bits = len(bits)
-
-    # Decode the individual bits
+    # Sum the widths of consecutive low and high pulses to get the bit widths
+    # and decode the individual bits. Ignore the last pulse if the list has an
+    # odd length.
     data = 0
-    for b in bits:
+    pulses = iter(dataset)
+    for low, high in zip(pulses, pulses):
+        b = low.width + high.width
         data = data << 1
         if sensors.is_bit0(b):
             pass
@@ -89,16 +111,11 @@ def decode_set(dataset):
             logging.warning("Invalid bit width (%d)", b)
             return None
 
-    return (dataset[0][0], data, num_bits)
+    return DataRecord(dataset[0].timestamp, data, len(dataset) // 2)
 
 
-def _timeout_handler(_signum, _frame):
-    """
-    Timeout handler
-    """
-    # Python3 stderr is likely buffered
-    sys.stderr.flush()
-    raise TimeoutError
+# Seconds to wait before retrying to open a busy device
+BUSY_RETRY = 5
 
 
 class RXB6(object):
@@ -109,26 +126,76 @@ class RXB6(object):
         self.device = device
         self.config = None
         if config:
-            with open(config) as fh:
-                self.config = yaml.load(fh)
+            self.config = _config.load(config)
 
-    def read(self, timeout=0):
+    def _open(self, deadline=None):
+        """
+        Open the device and return its file descriptor, retrying while it is
+        in use by another process. Return None if the device is still busy at
+        the deadline.
+        """
+        warned = False
+        while True:
+            try:
+                return os.open(self.device, os.O_RDONLY)
+            except OSError as e:
+                if e.errno != errno.EBUSY:
+                    raise
+            if deadline is not None and time.time() + BUSY_RETRY > deadline:
+                logging.warning("%s is busy, giving up", self.device)
+                return None
+            if not warned:
+                logging.warning("%s is busy, retrying", self.device)
+                warned = True
+            time.sleep(BUSY_RETRY)
+
+    def read(self, timeout=0, tick=0):
         """
         Read and return sensor data sets
+
+        Reading stops after 'timeout' seconds or never if 'timeout' is 0. If
+        'tick' is set, None is returned every 'tick' seconds so that the
+        caller can do periodic work while waiting for data.
         """
-        orig = None
-        if timeout:
-            # Install our timeout handler and arm the alarm
-            orig = signal.signal(signal.SIGALRM, _timeout_handler)
-            signal.alarm(timeout)
+        now = time.time()
+        deadline = now + timeout if timeout else None
+        next_tick = now + tick if tick else None
+
+        fd = self._open(deadline)
+        if fd is None:
+            return
 
         try:
-            with open(self.device) as fh:
-                record = False
-                data = []
+            buf = b""
+            record = False
+            data = []
 
-                for line in fh:
-                    line = line.strip()
+            while True:
+                now = time.time()
+                if next_tick is not None and now >= next_tick:
+                    yield None
+                    now = time.time()
+                    next_tick = now + tick
+                if deadline is not None and now >= deadline:
+                    break
+
+                # Wait for data, the deadline or the next tick
+                wait = [t - now for t in (deadline, next_tick)
+                        if t is not None]
+                ready, _, _ = select.select([fd], [], [],
+                                            min(wait) if wait else None)
+                if not ready:
+                    continue
+
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    break
+                timestamp = int(time.time())
+
+                lines = (buf + chunk).split(b"\n")
+                buf = lines.pop()
+                for line in lines:
+                    line = line.decode(errors="replace").strip()
 
                     if "SYNC" in line:
                         record = True
@@ -143,32 +210,32 @@ class RXB6(object):
                         continue
 
                     if record:
-                        # Prepend a timestamp to the line and append the record
-                        # to the collected data
-                        data.append([int(time.time())] + line.split(' '))
-
-        except TimeoutError:
-            pass
+                        # Parse the line and append the pulse to the collected
+                        # data
+                        data.append(parse_pulse(timestamp, line))
         finally:
-            if orig:
-                # Reinstall the original signal handler and cancel the alarm
-                signal.signal(signal.SIGALRM, orig)
-                signal.alarm(0)
+            os.close(fd)
 
-    def read_record(self, timeout=0):
+    def read_record(self, timeout=0, tick=0):
         """
         Read and return data records
         """
-        for dataset in self.read(timeout=timeout):
+        for dataset in self.read(timeout=timeout, tick=tick):
+            if dataset is None:
+                yield None
+                continue
             datarecord = decode_set(dataset)
             if datarecord:
                 yield datarecord
 
-    def read_decoded(self, timeout=0):
+    def read_decoded(self, timeout=0, tick=0):
         """
         Read and return decoded data records
         """
-        for datarecord in self.read_record(timeout=timeout):
+        for datarecord in self.read_record(timeout=timeout, tick=tick):
+            if datarecord is None:
+                yield None
+                continue
             decoded = sensors.decode(datarecord, self.config)
             if decoded:
                 yield decoded
@@ -8,6 +8,8 @@
 # under the terms of the GNU General Public License version 2 as published by
 # the Free Software Foundation.
 
+from collections import namedtuple
+
 BIT0_MIN = (0.9 * 2410)
 BIT0_MAX = (1.1 * 2960)
 
@@ -15,6 +17,12 @@ BIT1_MIN = (0.9 * 4450)
 BIT1_MAX = (1.1 * 5120)
 
 
+# Decoded sensor data. 'name' is the sensor name from the sensor config and
+# None if the data wasn't decoded with a config.
+Reading = namedtuple("Reading", "timestamp sensor sensor_id battery_status "
+                     "test_mode channel temperature humidity name")
+
+
 # -----------------------------------------------------------------------------
 # Helpers
 
@@ -99,18 +107,9 @@ def digoo_r8s(datarecord, identify=False):
         if not is_sensor(test_mode, channel, temperature):
             return None
 
-    result = {
-        "timestamp": timestamp,
-        "sensor": "r8s:%s:%s" % (sensor_id, channel),
-        "sensor_id": sensor_id,
-        "battery_status": battery_status,
-        "test_mode": test_mode,
-        "channel": channel,
-        "temperature": temperature,
-        "humidity": humidity
-    }
-
-    return result
+    return Reading(timestamp, "r8s:%s:%s" % (sensor_id, channel),
+                   sensor_id, battery_status, test_mode, channel, temperature,
+                   humidity, None)
 
 
 def globaltronics_gt_wt_02(datarecord, identify=False):
@@ -157,18 +156,9 @@ def globaltronics_gt_wt_02(datarecord, identify=False):
         if not is_sensor(test_mode, channel, temperature):
             return None
 
-    result = {
-        "timestamp": timestamp,
-        "sensor": "gt-wt-02:%s:%s" % (sensor_id, channel),
-        "sensor_id": sensor_id,
-        "battery_status": battery_status,
-        "test_mode": test_mode,
-        "channel": channel,
-        "temperature": temperature,
-        "humidity": humidity
-    }
-
-    return result
+    return Reading(timestamp, "gt-wt-02:%s:%s" % (sensor_id, channel),
+                   sensor_id, battery_status, test_mode, channel, temperature,
+                   humidity, None)
 
 
 SENSORS = (
@@ -208,9 +198,6 @@ def decode(datarecord, sensor_config):
 
     for sensor_decoder in SENSORS:
         data = sensor_decoder(datarecord)
-        if data:
-            sensor = data["sensor"]
-            if sensor in sensor_config:
-                data["name"] = sensor_config[sensor]
-                return data
+        if data and data.sensor in sensor_config:
+            return data._replace(name=sensor_config[data.sensor])
     return None
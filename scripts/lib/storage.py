@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+#
+# Time-partitioned sensor data storage
+#
+# Copyright (C) 2018 Juerg Haefliger <juergh@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+
+import calendar
+import glob
+import os
+import re
+import sqlite3
+import time
+
+# Raw data is stored in one database file per month (UTC), next to the main
+# database file:
+#   rxb6.db         Main database with the hourly rollups (and the legacy
+#                   unpartitioned 'data' table, if present)
+#   rxb6-201810.db  Raw data for October 2018
+#   rxb6-201811.db  Raw data for November 2018
+#   ...
+#
+# Expiring old raw data is done by deleting partition files, the rollups in
+# the main database are kept forever.
+#
+# Databases written by older versions keep all data in a single 'data' table
+# in the main database. That table is moved into partitions by migrate(),
+# which runs automatically on the first insert().
+
+ROLLUP_INTERVAL = 3600
+
+FETCH_SIZE = 1000
+
+_PARTITION_RE = re.compile(r"-(\d{4})(\d{2})\.db$")
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+
+def _month(timestamp):
+    """
+    Return the (year, month) tuple of a timestamp
+    """
+    t = time.gmtime(timestamp)
+    return (t.tm_year, t.tm_mon)
+
+
+def _month_start(year, month):
+    """
+    Return the timestamp of the start of a month
+    """
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def _month_end(year, month):
+    """
+    Return the timestamp of the start of the following month
+    """
+    if month == 12:
+        return _month_start(year + 1, 1)
+    return _month_start(year, month + 1)
+
+
+def _has_table(con, table):
+    """
+    Return true if the table exists in the database
+    """
+    cur = con.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                      "AND name=?", (table,))
+    return cur.fetchone() is not None
+
+
+def _where(start=None, end=None, names=None):
+    """
+    Build a WHERE clause and its parameters for a time range and sensor names
+    """
+    clauses = []
+    params = []
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("timestamp < ?")
+        params.append(end)
+    if names:
+        clauses.append("name IN (%s)" % ",".join("?" * len(names)))
+        params.extend(names)
+
+    if not clauses:
+        return "", params
+    return " WHERE " + " AND ".join(clauses), params
+
+
+# -----------------------------------------------------------------------------
+# Storage class
+
+class Storage(object):
+    """
+    Month-partitioned storage for sensor data
+    """
+    def __init__(self, db):
+        self.db = db
+        self.base = db[:-3] if db.endswith(".db") else db
+
+    def partition(self, timestamp):
+        """
+        Return the path of the partition for a timestamp
+        """
+        return "%s-%04d%02d.db" % ((self.base,) + _month(timestamp))
+
+    def partitions(self, start=None, end=None):
+        """
+        Return a sorted list of (start, end, path) tuples of the existing
+        partitions that overlap the specified time range
+        """
+        result = []
+        for path in glob.glob(glob.escape(self.base) + "-[0-9]*.db"):
+            m = _PARTITION_RE.search(path)
+            if not m:
+                continue
+            year, month = int(m.group(1)), int(m.group(2))
+            p_start = _month_start(year, month)
+            p_end = _month_end(year, month)
+            if start is not None and p_end <= start:
+                continue
+            if end is not None and p_start >= end:
+                continue
+            result.append((p_start, p_end, path))
+        return sorted(result)
+
+    def _connect_main(self):
+        con = sqlite3.connect(self.db)
+        con.execute("CREATE TABLE IF NOT EXISTS rollup (timestamp INTEGER, "
+                    "name TEXT, temperature REAL, humidity REAL, "
+                    "count INTEGER, PRIMARY KEY (timestamp, name))")
+        return con
+
+    def _connect_partition(self, path):
+        con = sqlite3.connect(path)
+        con.execute("CREATE TABLE IF NOT EXISTS data (timestamp INTEGER, "
+                    "name TEXT, temperature REAL, humidity REAL)")
+        con.execute("CREATE INDEX IF NOT EXISTS data_timestamp ON "
+                    "data (timestamp)")
+        return con
+
+    def _rollup(self, main, part, start, end, table="data"):
+        """
+        (Re-)calculate the rollups of a partition for the specified time range
+        """
+        interval = ROLLUP_INTERVAL
+        cur = part.execute("SELECT (timestamp / ?) * ?, name, "
+                           "AVG(temperature), AVG(humidity), COUNT(*) "
+                           "FROM " + table + " WHERE "
+                           "timestamp >= ? AND timestamp < ? GROUP BY 1, 2",
+                           (interval, interval, start, end))
+        main.executemany("INSERT OR REPLACE INTO rollup (timestamp, name, "
+                         "temperature, humidity, count) VALUES (?, ?, ?, ?, "
+                         "?)", cur.fetchall())
+
+    def migrate(self):
+        """
+        Move the legacy unpartitioned data from the main database into
+        partitions, calculate its rollups and return the list of partitions
+        that data was moved to
+        """
+        if not os.path.exists(self.db):
+            return []
+
+        migrated = []
+        main = self._connect_main()
+        try:
+            if not _has_table(main, "data"):
+                return []
+
+            # Speeds up moving the data month by month, dropped together with
+            # the table
+            main.execute("CREATE INDEX IF NOT EXISTS data_timestamp ON "
+                         "data (timestamp)")
+
+            # Move the data of the month of the oldest remaining row until
+            # the table is empty, which skips months without data
+            while True:
+                first = main.execute("SELECT MIN(timestamp) FROM "
+                                     "data").fetchone()[0]
+                if first is None:
+                    break
+                start = _month_start(*_month(first))
+                end = _month_end(*_month(first))
+                path = self.partition(start)
+                self._connect_partition(path).close()
+
+                # Move the rows of one month and calculate their rollups in a
+                # single transaction across both databases, so that an
+                # interrupted migration can simply be restarted
+                main.execute("ATTACH DATABASE ? AS part", (path,))
+                main.execute("INSERT INTO part.data (timestamp, name, "
+                             "temperature, humidity) SELECT timestamp, name, "
+                             "temperature, humidity FROM main.data WHERE "
+                             "timestamp >= ? AND timestamp < ?", (start, end))
+                self._rollup(main, main, start, end, table="part.data")
+                main.execute("DELETE FROM main.data WHERE timestamp >= ? AND "
+                             "timestamp < ?", (start, end))
+                main.commit()
+                main.execute("DETACH DATABASE part")
+                migrated.append(path)
+
+            # Drop the legacy table and give the space back
+            main.execute("DROP TABLE data")
+            main.commit()
+            main.execute("VACUUM")
+        finally:
+            main.close()
+
+        return migrated
+
+    def insert(self, data):
+        """
+        Write data to the partitions and update the rollups
+
+        The data is a sequence of records with timestamp, name, temperature
+        and humidity attributes (like lib.rxb6.Average).
+        """
+        self.migrate()
+
+        # Group the data by partition
+        parts = {}
+        for d in data:
+            parts.setdefault(self.partition(d.timestamp), []).append(
+                (d.timestamp, d.name, d.temperature, d.humidity))
+
+        with self._connect_main() as main:
+            for path in sorted(parts):
+                with self._connect_partition(path) as part:
+                    part.executemany("INSERT INTO data (timestamp, name, "
+                                     "temperature, humidity) VALUES "
+                                     "(?, ?, ?, ?)", parts[path])
+                    part.commit()
+
+                    # Update the rollups of the affected intervals
+                    for hour in set(d[0] // ROLLUP_INTERVAL
+                                    for d in parts[path]):
+                        self._rollup(main, part, hour * ROLLUP_INTERVAL,
+                                     (hour + 1) * ROLLUP_INTERVAL)
+                part.close()
+            main.commit()
+        main.close()
+
+    def _batches(self, table, paths, start, end, names, size):
+        """
+        Return batches of rows of a table in the specified databases
+        """
+        if size is None:
+            size = FETCH_SIZE
+        if size < 1:
+            raise ValueError("Invalid fetch size: %s" % size)
+
+        where, params = _where(start, end, names)
+        select = ("SELECT rowid, timestamp, name, temperature, humidity FROM " +
+                  table)
+        order = " ORDER BY timestamp, rowid LIMIT ?"
+        first_sql = select + where + order
+
+        # Continue after the last row of the previous batch
+        after = "(timestamp > ? OR (timestamp = ? AND rowid > ?))"
+        if where:
+            next_sql = select + where + " AND " + after + order
+        else:
+            next_sql = select + " WHERE " + after + order
+
+        # Every batch is fetched with a separate query that runs to
+        # completion, so no read lock is held while the caller processes the
+        # batch and concurrent writers aren't blocked
+        for path in paths:
+            con = sqlite3.connect(path)
+            try:
+                if not _has_table(con, table):
+                    continue
+                rows = con.execute(first_sql, params + [size]).fetchall()
+                while rows:
+                    yield [row[1:] for row in rows]
+                    if len(rows) < size:
+                        break
+                    rowid, timestamp = rows[-1][0], rows[-1][1]
+                    rows = con.execute(next_sql, params + [timestamp,
+                                                           timestamp, rowid,
+                                                           size]).fetchall()
+            finally:
+                con.close()
+
+    def query_batches(self, start=None, end=None, names=None,
+                      size=None):
+        """
+        Return batches of raw data rows for the specified time range and
+        sensor names across all partitions
+        """
+        paths = [p[2] for p in self.partitions(start, end)]
+        if os.path.exists(self.db):
+            # Legacy unpartitioned data in the main database
+            paths.insert(0, self.db)
+        return self._batches("data", paths, start, end, names, size)
+
+    def query_rollup_batches(self, start=None, end=None, names=None,
+                             size=None):
+        """
+        Return batches of rollup rows for the specified time range and sensor
+        names
+        """
+        paths = [self.db] if os.path.exists(self.db) else []
+        return self._batches("rollup", paths, start, end, names, size)
+
+    def query(self, start=None, end=None, names=None):
+        """
+        Return the raw data rows for the specified time range and sensor
+        names across all partitions
+        """
+        for rows in self.query_batches(start, end, names):
+            for row in rows:
+                yield row
+
+    def query_rollup(self, start=None, end=None, names=None):
+        """
+        Return the rollup rows for the specified time range and sensor names
+        """
+        for rows in self.query_rollup_batches(start, end, names):
+            for row in rows:
+                yield row
+
+    def expire(self, days, now=None):
+        """
+        Delete the partitions that only contain data older than the specified
+        number of days and return the list of deleted partition files
+        """
+        self.migrate()
+
+        if now is None:
+            now = time.time()
+        cutoff = now - days * 86400
+
+        deleted = []
+        with self._connect_main() as main:
+            for start, end, path in self.partitions(end=cutoff):
+                if end > cutoff:
+                    continue
+
+                # Make sure the rollups are complete before dropping the raw
+                # data
+                part = sqlite3.connect(path)
+                try:
+                    self._rollup(main, part, start, end)
+                finally:
+                    part.close()
+                main.commit()
+
+                os.remove(path)
+                deleted.append(path)
+        main.close()
+
+        return deleted
@@ -11,28 +11,36 @@
 import cgitb
 cgitb.enable()  # for troubleshooting
 
-import sqlite3
 import sys
+import time
 import traceback
 
+from lib.storage import ROLLUP_INTERVAL, Storage
 
-def get_data(db, sensors=None):
+# Number of days to show the raw data for, older data is shown from the hourly
+# rollups
+RAW_DAYS = 7
+
+
+def get_data(db, sensors=None, days=RAW_DAYS):
     """
     Get the data for the specified sensors from the database
     """
     result = {}
 
-    with sqlite3.connect(db) as con:
-        cur = con.cursor()
-        cur.execute("SELECT * FROM data")
-        rows = cur.fetchall()
+    storage = Storage(db)
 
+    # Align the cutoff to the rollup interval, so that no data is shown both
+    # raw and rolled up
+    cutoff = int(time.time()) - days * 86400
+    cutoff -= cutoff % ROLLUP_INTERVAL
+    for rows in (storage.query_rollup(end=cutoff, names=sensors),
+                 storage.query(start=cutoff, names=sensors)):
         for row in rows:
             sensor = row[1]
-            if not sensors or sensor in sensors:
-                if sensor not in result:
-                    result[sensor] = []
-                result[sensor].append(row)
+            if sensor not in result:
+                result[sensor] = []
+            result[sensor].append(row)
 
     return result
 
@@ -59,10 +67,10 @@ def render_page():
     """
     Render the HTML page
     """
-    data = get_data("./rxb6.db")
-
     sensor = "2491:1"
 
+    data = get_data("./rxb6.db", sensors=[sensor])
+
     # Convert the data
 
     temperature = [[d[0], d[2]] for d in data[sensor]]
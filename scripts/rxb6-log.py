@@ -9,45 +9,101 @@
 # the Free Software Foundation.
 
 import argparse
-import os
+import logging
 import sqlite3
 import sys
+import time
 
-from lib.rxb6 import RXB6
+from lib.rxb6 import RXB6, average_data, init_logging
+from lib.storage import Storage
 
+# Number of seconds to average the data over
+DURATION = 90
 
-def create_db(db):
-    with sqlite3.connect(db) as con:
-        cur = con.cursor()
-        cur.execute("CREATE TABLE data (timestamp INTEGER, name TEXT, "
-                    "temperature REAL, humidity REAL)")
-        con.commit()
+
+def write_data(storage, data, retention):
+    """
+    Write averaged data to the database
+    """
+    if not data:
+        return False
+
+    storage.insert(data)
+
+    # Drop expired raw data
+    if retention is not None:
+        storage.expire(retention)
+
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("config", help="The sensor config file to use.")
     parser.add_argument("db", help="The database file to write the data to.")
+    parser.add_argument("-r", "--retention", type=int, help="Number of days "
+                        "to keep the raw data for. Older monthly partitions "
+                        "are deleted, the hourly rollups are kept. Raw data "
+                        "is kept forever if not set.")
+    parser.add_argument("-D", "--daemon", action="store_true", help="Keep "
+                        "running and write averaged data every %d seconds "
+                        "rather than exiting after the first write. Don't "
+                        "run this from cron at the same time, only one "
+                        "process can read the device." % DURATION)
+    parser.add_argument("-a", "--alerts", help="The alert rules file to "
+                        "evaluate on the data as it arrives (requires "
+                        "--daemon).")
+    parser.add_argument("-i", "--interval", type=int, default=30,
+                        help="Interval in seconds for checking for stale "
+                        "sensors. Defaults to 30 if not set.")
 
     args = parser.parse_args()
+    if args.alerts and not args.daemon:
+        parser.error("--alerts requires --daemon")
+    if args.interval < 1:
+        parser.error("--interval needs to be positive")
+    init_logging()
 
-    # Read data for 90 seconds and average it
-    data = RXB6("/dev/rxb6", config=args.config).read_average(90)
-    if not data:
-        return 1
-
-    # Create the database if it doesn't exist
-    if not os.path.exists(args.db):
-        create_db(args.db)
-
-    # Write the data to the database
-    with sqlite3.connect(args.db) as con:
-        cur = con.cursor()
-        for d in data:
-            cur.execute("INSERT INTO data (timestamp, name, temperature, "
-                        "humidity) VALUES (:timestamp, :name, :temperature, "
-                        ":humidity)", d)
-        con.commit()
+    engine = None
+    if args.alerts:
+        from lib.alerts import AlertEngine
+        engine = AlertEngine.from_file(args.alerts)
+
+    rxb6 = RXB6("/dev/rxb6", config=args.config)
+    storage = Storage(args.db)
+
+    if not args.daemon:
+        # Read data for DURATION seconds and average it
+        data = average_data(rxb6.read_decoded(timeout=DURATION))
+        return 0 if write_data(storage, data, args.retention) else 1
+
+    # Keep the device open, evaluate the alert rules on each data record and
+    # write the averaged data every DURATION seconds
+    data = []
+    pending = []
+    window_end = time.time() + DURATION
+    for d in rxb6.read_decoded(tick=args.interval):
+        if d is not None:
+            data.append(d)
+            if engine:
+                engine.process(d)
+        elif engine:
+            engine.check_stale()
+
+        if time.time() >= window_end:
+            pending.extend(average_data(data))
+            data = []
+            window_end = time.time() + DURATION
+            # A failed write must not stop the alerting. Keep the averaged
+            # data and retry with the next window.
+            try:
+                if pending:
+                    storage.insert(pending)
+                    pending = []
+                if args.retention is not None:
+                    storage.expire(args.retention)
+            except (sqlite3.Error, OSError) as e:
+                logging.error("Failed to write data (%s)", e)
 
     return 0
 
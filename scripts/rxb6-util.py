@@ -9,11 +9,13 @@
 # the Free Software Foundation.
 
 import argparse
-import logging
-import sqlite3
 import sys
+import time
 
-from lib.rxb6 import RXB6
+from lib import export
+
+# The subsystems (logging, device access, storage) are imported by the
+# subcommands that need them to keep the startup time short
 
 
 def _dec(name, *args, **kwargs):
@@ -28,6 +30,37 @@ def _dec(name, *args, **kwargs):
     return _decorator
 
 
+def timestamp(value):
+    """
+    Convert a command line time argument (seconds since the epoch or a local
+    'YYYY-MM-DD[ HH:MM[:SS]]' date) to seconds since the epoch
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(value, fmt)))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("invalid time: '%s'" % value)
+
+
+def positive_int(value):
+    """
+    Convert a command line argument to a positive integer
+    """
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if result < 1:
+        raise argparse.ArgumentTypeError("invalid positive integer: '%s'" %
+                                         value)
+    return result
+
+
 def add_help(*args, **kwargs):
     return _dec("help", *args, **kwargs)
 
@@ -38,15 +71,82 @@ def add_arg(*args, **kwargs):
 
 @add_help("dump a database")
 @add_arg("db", help="path to the database")
+@add_arg("-r", "--rollup", action="store_true", help="dump the hourly "
+         "rollups rather than the raw data.")
+@add_arg("-f", "--format", choices=sorted(export.FORMATS), default="text",
+         help="output format. Defaults to 'text' if not set.")
+@add_arg("-s", "--start", type=timestamp, help="only dump data from this "
+         "time on (seconds since the epoch or 'YYYY-MM-DD[ HH:MM[:SS]]').")
+@add_arg("-e", "--end", type=timestamp, help="only dump data before this "
+         "time (seconds since the epoch or 'YYYY-MM-DD[ HH:MM[:SS]]').")
+@add_arg("-n", "--name", action="append", help="only dump data of this "
+         "sensor. Can be specified multiple times.")
+@add_arg("-o", "--output", help="file to write the data to. Defaults to "
+         "stdout if not set.")
+@add_arg("-B", "--batch-size", type=positive_int, help="number of rows to "
+         "fetch and write at a time. Defaults to the storage fetch size if "
+         "not set.")
 def do_dump(args):
     """
-    Dump a database
+    Dump a database. The data is streamed in batches so that memory use is
+    bounded regardless of the size of the database.
     """
-    with sqlite3.connect(args.db) as con:
-        cur = con.cursor()
-        cur.execute("SELECT * FROM data")
-        for row in cur.fetchall():
-            print(row)
+    from lib.storage import Storage
+
+    storage = Storage(args.db)
+    if args.rollup:
+        batches = storage.query_rollup_batches(args.start, args.end,
+                                               args.name, args.batch_size)
+    else:
+        batches = storage.query_batches(args.start, args.end, args.name,
+                                        args.batch_size)
+
+    writer, binary = export.FORMATS[args.format]
+    if args.output:
+        if binary:
+            fh = open(args.output, "wb")
+        else:
+            # The csv module needs newline translation to be disabled
+            fh = open(args.output, "w", newline="")
+        with fh:
+            writer(batches, fh)
+    else:
+        writer(batches, sys.stdout.buffer if binary else sys.stdout)
+
+
+@add_help("delete expired raw data")
+@add_arg("db", help="path to the database")
+@add_arg("days", type=int, help="number of days to keep the raw data for")
+def do_expire(args):
+    """
+    Delete the monthly raw data partitions that only contain data older than
+    the specified number of days. The hourly rollups are kept.
+    """
+    import logging
+    from lib.rxb6 import init_logging
+    from lib.storage import Storage
+    init_logging()
+
+    for path in Storage(args.db).expire(args.days):
+        logging.info("Deleted %s", path)
+
+
+@add_help("move legacy data into monthly partitions")
+@add_arg("db", help="path to the database")
+def do_migrate(args):
+    """
+    Move the data of a database written by an older version of rxb6-log from
+    the single 'data' table into monthly partitions and calculate the hourly
+    rollups. This also happens automatically on the first write to the
+    database.
+    """
+    import logging
+    from lib.rxb6 import init_logging
+    from lib.storage import Storage
+    init_logging()
+
+    for path in Storage(args.db).migrate():
+        logging.info("Migrated %s", path)
 
 
 @add_help("print sensor data")
@@ -59,34 +159,47 @@ def do_dump(args):
 @add_arg("-b", "--binary", action="store_true", help="print the data in "
          "binary format (only used for 'record').")
 def do_print(args):
+    import logging
+    from lib.rxb6 import RXB6, init_logging
+    init_logging()
+
     rxb6 = RXB6("/dev/rxb6", config=args.config)
     if args.type == "raw":
         for data in rxb6.read():
-            logging.info(data)
+            logging.info([tuple(d) for d in data])
 
     elif args.type == "record":
         for data in rxb6.read_record():
             if args.binary:
-                logging.info("%s %s %s", data[0],
-                             format(data[1], "0%db" % data[2]), data[2])
+                logging.info("%s %s %s", data.timestamp,
+                             format(data.data, "0%db" % data.num_bits),
+                             data.num_bits)
             else:
-                logging.info(data)
+                logging.info(tuple(data))
 
     elif args.type == "decoded":
         for data in rxb6.read_decoded():
-            logging.info(data)
+            if isinstance(data, list):
+                # Decoded without a sensor config
+                logging.info([d._asdict() for d in data])
+            else:
+                logging.info(data._asdict())
 
     else:
         while True:
             for data in rxb6.read_average(args.duration):
-                logging.info(data)
+                logging.info(data._asdict())
 
 
 @add_help("scan for sensors")
 def do_scan(_args):
+    import logging
+    from lib.rxb6 import RXB6, init_logging
+    init_logging()
+
     rxb6 = RXB6("/dev/rxb6")
     for data in rxb6.scan():
-        logging.info(data)
+        logging.info(data._asdict())
 
 
 def add_subcommand_parsers(subparser):